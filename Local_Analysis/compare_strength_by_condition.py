@@ -5,74 +5,99 @@ Description:
 This script analyzes and visualizes local node strength metrics computed from fNIRS intra-brain correlation data.
 It reads a CSV containing node-level strengths for each participant (baby/parent) under various conditions,
 computes the average strength per node, and generates comparison plots between roles.
+Differences are tested per node with paired sign-flip permutation tests (../analysis/permutation_tests.py),
+corrected for all nodes × contrasts with the max-statistic (FWER) method.
 
 Key Features:
-- Fixes label typos in the input data.
-- Sorts nodes numerically (S1 to S18).
+- Reads the cleaned table from the results store (../Scripts/results_store.py): roles are spelled
+  baby / parent and nodes are integer ids, so nodes sort numerically (S1, S2, ..., S10).
 - Computes group-level average strength per node by condition and role.
 - Saves output as a structured CSV and visualizes results using bar plots.
+- Tests condition contrasts within role and baby vs parent within dyad, for every node.
 
 Inputs:
-- ../Scripts/Local_strengths.csv
+- ../Scripts/results_store/local/ (built from ../Scripts/Local_strengths.csv)
 
 Outputs:
 - local_comparisons_output/local_strength_condition.csv
+- local_comparisons_output/local_strength_condition_permutation_tests.csv
+- local_comparisons_output/local_strength_role_permutation_tests.csv
 - local_visualizations/strength_by_node_<condition>.png
 
 Dependencies:
 - Python 3.x
 - pandas, seaborn, matplotlib, os
+- ../analysis/permutation_tests.py, ../Scripts/results_store.py
 """
 import os
+import sys
+from itertools import combinations
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-# 🔹 Define path to the local strengths CSV file (relative to this script)
-csv_input_path = os.path.join("..", "Scripts", "Local_strengths.csv")
-
-# Load data from CSV
-df = pd.read_csv(csv_input_path)
-
-# Fix typo in role labels: 'perant' → 'parent'
-df["Role"] = df["Role"].replace("perant", "parent")
-
-# Sort nodes numerically (S1 to S18)
-df["Node_num"] = df["Node"].str.extract(r'S(\d+)').astype(int)
-df = df.sort_values("Node_num")
-df.drop(columns="Node_num", inplace=True)
-
-# 🔹 Compute average strength per (Condition, Role, Node)
-summary = (
-    df.groupby(["Condition", "Role", "Node"])["Strength"]
-    .mean()
-    .round(3)
-    .reset_index()
-)
-
-# 🔹 Create output folders relative to the current script directory
-output_dir = "local_comparisons_output"
-plots_dir = "local_visualizations"
-os.makedirs(output_dir, exist_ok=True)
-os.makedirs(plots_dir, exist_ok=True)
-
-# 🔹 Save summary as a CSV file
-csv_output_path = os.path.join(output_dir, "local_strength_condition.csv")
-summary.to_csv(csv_output_path, index=False)
-print(f"✅ Saved summary to: {csv_output_path}")
-
-# 🔹 Generate and save bar plots for each condition
-conditions = summary["Condition"].unique()
-for cond in conditions:
-    plt.figure(figsize=(12, 6))
-    sub = summary[summary["Condition"] == cond]
-    sns.barplot(data=sub, x="Node", y="Strength", hue="Role", palette="Set2")
-    plt.title(f"Average Node Strength - {cond}")
-    plt.ylabel("Mean Strength")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-
-    plot_path = os.path.join(plots_dir, f"strength_by_node_{cond}.png")
-    plt.savefig(plot_path, dpi=300)
-    plt.close()
-    print(f"📊 Saved plot: {plot_path}")
+# Folder of this script, so outputs land next to it whatever the working directory is
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "analysis"))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "Scripts"))
+from permutation_tests import default_permutations, permutation_table
+from results_store import group_by, node_labels, read_table
+from instrumentation import timed
+
+
+def main(n_permutations=default_permutations, workers=1):
+    # 🔹 Compute average strength per (Condition, Role, Node); nodes are integer ids, sorted numerically
+    with timed("load"):
+        summary = group_by("local", ["Condition", "Role", "Node"], "Strength").round(3)
+        summary["Node"] = node_labels(summary["Node"])
+        df = read_table("local", ["Dyad", "Condition", "Role", "Node", "Strength"])
+
+    # 🔹 Create output folders relative to the current script directory
+    output_dir = os.path.join(SCRIPT_DIR, "local_comparisons_output")
+    plots_dir = os.path.join(SCRIPT_DIR, "local_visualizations")
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(plots_dir, exist_ok=True)
+
+    # 🔹 Save summary as a CSV file
+    csv_output_path = os.path.join(output_dir, "local_strength_condition.csv")
+    summary.to_csv(csv_output_path, index=False)
+    print(f"✅ Saved summary to: {csv_output_path}")
+
+    # 🔹 Paired sign-flip permutation tests per node (max-|t| FWER over each table)
+    condition_pairs = list(combinations(sorted(df["Condition"].unique()), 2))
+    with timed("permutation_tests"):
+        condition_tests = permutation_table(df, "Condition", condition_pairs, ["Role", "Node"], ["Strength"],
+                                            n_permutations=n_permutations, workers=workers)
+    condition_tests["Node"] = node_labels(condition_tests["Node"])
+    condition_tests_path = os.path.join(output_dir, "local_strength_condition_permutation_tests.csv")
+    condition_tests.to_csv(condition_tests_path, index=False)
+    print(f"✅ Saved condition permutation tests to: {condition_tests_path}")
+
+    with timed("permutation_tests"):
+        role_tests = permutation_table(df, "Role", [("baby", "parent")], ["Condition", "Node"], ["Strength"],
+                                       n_permutations=n_permutations, workers=workers)
+    role_tests["Node"] = node_labels(role_tests["Node"])
+    role_tests_path = os.path.join(output_dir, "local_strength_role_permutation_tests.csv")
+    role_tests.to_csv(role_tests_path, index=False)
+    print(f"✅ Saved baby vs parent permutation tests to: {role_tests_path}")
+
+    # 🔹 Generate and save bar plots for each condition
+    conditions = summary["Condition"].unique()
+    for cond in conditions:
+        with timed("plot", cond):
+            plt.figure(figsize=(12, 6))
+            sub = summary[summary["Condition"] == cond]
+            sns.barplot(data=sub, x="Node", y="Strength", hue="Role", palette="Set2")
+            plt.title(f"Average Node Strength - {cond}")
+            plt.ylabel("Mean Strength")
+            plt.xticks(rotation=45)
+            plt.tight_layout()
+
+            plot_path = os.path.join(plots_dir, f"strength_by_node_{cond}.png")
+            plt.savefig(plot_path, dpi=300)
+            plt.close()
+        print(f"📊 Saved plot: {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,13 @@ Script Name: compare_strength_by_dyad.py
 Description:
 This script compares local node strengths between baby and parent participants across dyads.
 It reads the precomputed node strengths from fNIRS intra-brain analysis and:
-1. Calculates the strength difference (baby - parent) for each node in each dyad.
+1. Calculates the strength difference (baby - parent) for each node in each dyad and condition
+   (../analysis/dyad_comparisons.py pivots the table once; no per-dyad filtering).
 2. Saves the results in a structured CSV file.
 3. Visualizes the average difference across all dyads as a bar plot.
 
 Inputs:
-- ../Scripts/Local_strengths.csv
+- ../Scripts/results_store/local/ (built from ../Scripts/Local_strengths.csv)
 
 Outputs:
 - local_comparisons_output/local_strength_dyad_comparison.csv
@@ -18,68 +19,62 @@ Outputs:
 Dependencies:
 - Python 3.x
 - pandas, seaborn, matplotlib
+- ../analysis/dyad_comparisons.py, ../Scripts/results_store.py
 """
 import os
+import sys
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-# 🔹 Load CSV from Scripts directory
-csv_input_path = os.path.join("..", "Scripts", "Local_strengths.csv")
-df = pd.read_csv(csv_input_path)
+# Folder of this script, so outputs land next to it whatever the working directory is
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "analysis"))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "Scripts"))
+from dyad_comparisons import compare_roles
+from results_store import node_labels
 
-# Fix typo in Role column: 'perant' → 'parent'
-df["Role"] = df["Role"].replace("perant", "parent")
 
-# 🔹 Compute strength differences between baby and parent for each dyad and node
-results = []
-dyads = df["Dyad"].unique()
-nodes = sorted(df["Node"].unique())
+def main():
+    # 🔹 Compute strength differences between baby and parent for each dyad, condition and node
+    comparison = compare_roles("local", ["Dyad", "Condition", "Node"], ["Strength"])
+    df_diff = pd.DataFrame({
+        "Dyad": comparison["Dyad"],
+        "Condition": comparison["Condition"],
+        "Node": node_labels(comparison["Node"]),
+        "Baby Strength": comparison["Baby"].round(3),
+        "Parent Strength": comparison["Parent"].round(3),
+        "Difference (Baby - Parent)": comparison["Difference"].round(3)
+    })
 
-for dyad in dyads:
-    sub = df[df["Dyad"] == dyad]
-    for node in nodes:
-        node_data = sub[sub["Node"] == node]
-        # Ensure both roles exist for this node in this dyad
-        if set(node_data["Role"]) != {"baby", "parent"}:
-            continue
-        baby_val = node_data[node_data["Role"] == "baby"]["Strength"].values[0]
-        parent_val = node_data[node_data["Role"] == "parent"]["Strength"].values[0]
-        diff = baby_val - parent_val
-        results.append({
-            "Dyad": dyad,
-            "Node": node,
-            "Baby Strength": round(baby_val, 3),
-            "Parent Strength": round(parent_val, 3),
-            "Difference (Baby - Parent)": round(diff, 3)
-        })
+    # 🔹 Create local folders for saving outputs (relative to current script)
+    output_dir = os.path.join(SCRIPT_DIR, "local_comparisons_output")
+    plots_dir = os.path.join(SCRIPT_DIR, "local_visualizations")
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(plots_dir, exist_ok=True)
 
-df_diff = pd.DataFrame(results)
+    # 🔹 Save comparison table as CSV
+    csv_output_path = os.path.join(output_dir, "local_strength_dyad_comparison.csv")
+    df_diff.to_csv(csv_output_path, index=False)
+    print("✅ Saved CSV to:", csv_output_path)
 
-# 🔹 Create local folders for saving outputs (relative to current script)
-output_dir = "local_comparisons_output"
-plots_dir = "local_visualizations"
-os.makedirs(output_dir, exist_ok=True)
-os.makedirs(plots_dir, exist_ok=True)
+    # 🔹 Plot: average strength difference per node (Baby - Parent), over dyads and conditions
+    avg_diff = df_diff.groupby("Node", sort=False)["Difference (Baby - Parent)"].mean()
 
-# 🔹 Save comparison table as CSV
-csv_output_path = os.path.join(output_dir, "local_strength_dyad_comparison.csv")
-df_diff.to_csv(csv_output_path, index=False)
-print("✅ Saved CSV to:", csv_output_path)
+    plt.figure(figsize=(10, 6))
+    sns.barplot(x=avg_diff.index, y=avg_diff.values, palette="coolwarm")
+    plt.axhline(0, linestyle="--", color="gray")
+    plt.title("Average Strength Difference (Baby - Parent) per Node")
+    plt.ylabel("Mean Difference")
+    plt.xlabel("Node")
+    plt.tight_layout()
 
-# 🔹 Plot: average strength difference per node (Baby - Parent)
-avg_diff = df_diff.groupby("Node")["Difference (Baby - Parent)"].mean().sort_index()
+    plot_path = os.path.join(plots_dir, "strength_difference_by_node.png")
+    plt.savefig(plot_path, dpi=300)
+    plt.close()
 
-plt.figure(figsize=(10, 6))
-sns.barplot(x=avg_diff.index, y=avg_diff.values, palette="coolwarm")
-plt.axhline(0, linestyle="--", color="gray")
-plt.title("Average Strength Difference (Baby - Parent) per Node")
-plt.ylabel("Mean Difference")
-plt.xlabel("Node")
-plt.tight_layout()
+    print("✅ Saved plot to:", plot_path)
 
-plot_path = os.path.join(plots_dir, "strength_difference_by_node.png")
-plt.savefig(plot_path, dpi=300)
-plt.close()
 
-print("✅ Saved plot to:", plot_path)
+if __name__ == "__main__":
+    main()
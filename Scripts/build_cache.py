@@ -0,0 +1,81 @@
+"""
+Module Name: build_cache.py
+
+Description:
+Content-hash build cache for incremental pipeline runs.
+
+Each stage keeps a small JSON manifest (".build_cache/<stage>.json" next to the scripts)
+that maps every output key (usually a recording filename) to a fingerprint: a SHA-256
+over the content of the input files plus the stage parameters that affect the output
+(e.g. threshold, p_cutoff). On the next run only keys whose fingerprint changed, or
+whose outputs are missing, are recomputed. Unlike "skip if the destination exists",
+this notices when a source file or a parameter changes.
+
+Functions:
+- file_hash(path)                       → SHA-256 hex digest of a file's content
+- fingerprint(paths, params, hashes)    → SHA-256 hex digest of input contents + parameters
+- load_manifest(stage) / save_manifest(stage, manifest)
+- is_fresh(manifest, key, fp, outputs)  → True if key is cached with fp and all outputs exist
+
+Dependencies:
+- hashlib, json, os
+"""
+import os
+import json
+import hashlib
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FOLDER = os.path.join(SCRIPT_DIR, ".build_cache")
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(paths, params=None, hashes=()):
+    """
+    Fingerprint of the content of the input files plus the stage parameters.
+
+    hashes: content digests of inputs that are not files of their own (e.g. one recording of the
+    correlation store), used like the digests of the files.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_hash(path).encode())
+    for content_hash in hashes:
+        digest.update(content_hash.encode())
+    digest.update(json.dumps(params or {}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def manifest_path(stage):
+    return os.path.join(CACHE_FOLDER, f"{stage}.json")
+
+
+def load_manifest(stage):
+    """Load the manifest of a stage; a missing or unreadable manifest means nothing is cached."""
+    try:
+        with open(manifest_path(stage), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(stage, manifest):
+    """Write the manifest atomically, so an interrupted run never leaves a corrupt cache."""
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    path = manifest_path(stage)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_fresh(manifest, key, fp, outputs=()):
+    """True if key was built from the same fingerprint and all of its outputs still exist."""
+    return manifest.get(key) == fp and all(os.path.exists(path) for path in outputs)
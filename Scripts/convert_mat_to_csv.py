@@ -1,40 +1,170 @@
+"""
+Script Name: convert_mat_to_csv.py
+
+Description:
+Converts the raw .mat recordings into the binary intermediate format used by the rest of the pipeline.
+Every recording is written as a .npy file (samples × channels, float64), which later stages memory-map
+without any text parsing. CSV export is kept as an optional side output (--csv).
+
+The recordings are taken from the recording catalog (recording_catalog.py), and every output is
+named after the canonical recording id (e.g. dyad11_instruct_parent.npy for
+dyad11_insrtuct_perant.mat), so no later stage has to fix the raw file names.
+
+Both MATLAB v5/v7 and v7.3 (HDF5, needs h5py) files are read, through mat_reader.py. The data
+variable is chosen explicitly (--variable, else the one recorded in the catalog: the variable named
+<condition><role>, else the only 2-D numeric variable), and a file holding a variable named after
+another condition or role is reported. Recordings are streamed in chunks of --chunk-samples samples into
+a memory-mapped .npy file (np.lib.format.open_memmap), so long v7.3 sessions convert with flat memory.
+
+Every recording also gets a channel metadata sidecar (recording_io.py): channel names and
+short-separation flags, copied from a <recording>.channels.csv next to the .mat file when there is
+one, or S1..Sn for the n channels of the recording otherwise.
+
+A content-hash build cache (build_cache.py), keyed by the content hash in the catalog, skips .mat
+files that are unchanged since the last run; --force converts everything again. Outputs of
+recordings that left the catalog are deleted.
+
+Input:
+- "recording_catalog.csv" → the .mat files in "../finalproject_records/" (optional
+  <recording>.channels.csv sidecars next to them)
+
+Output:
+- Folder: "npy_output/"  → <Recording>.npy, <Recording>.channels.csv
+- Folder: "csv_output/"  → <Recording>.csv   (only with --csv)
+
+Dependencies:
+- numpy, pandas
+- mat_reader.py, recording_catalog.py, recording_io.py, build_cache.py, instrumentation.py (same folder)
+"""
 import os
-from scipy.io import loadmat
+import argparse
+import numpy as np
 import pandas as pd
+from mat_reader import default_chunk_samples, iter_chunks, recording_shape, select_variable
+from recording_catalog import load_catalog, source_path
+from recording_io import channel_metadata_path, load_channel_metadata, save_channel_metadata
+from build_cache import fingerprint, is_fresh, load_manifest, save_manifest
+from instrumentation import stage, timed
+
+# Folder of this script, so the stage works from any working directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Define output folders for the binary recordings and the optional CSV copies
+output_folder = os.path.join(SCRIPT_DIR, "npy_output")
+csv_folder = os.path.join(SCRIPT_DIR, "csv_output")
+
+
+def output_paths(recording, csv):
+    """Files written for one catalogued recording."""
+    npy_path = os.path.join(output_folder, f"{recording}.npy")
+    paths = [npy_path, channel_metadata_path(npy_path)]
+    if csv:
+        paths.append(os.path.join(csv_folder, f"{recording}.csv"))
+    return paths
+
+
+def convert_recording(recording, row, variable, csv, chunk_samples):
+    """
+    Stream the data variable of one .mat file into its .npy (and optional .csv) output, chunk by chunk.
+
+    Returns the name of the variable that was read. Raises ValueError when no data variable can be
+    selected or when the channel sidecar does not match the data.
+    """
+    filepath = source_path(row)
+    if variable is not None:
+        variable = select_variable(filepath, variable)
+    elif pd.isna(row["Variable"]):
+        raise ValueError("no data variable could be chosen; choose one with --variable")
+    else:
+        variable = row["Variable"]
+    n_samples, n_channels = recording_shape(filepath, variable)
+
+    # Channel names and short-channel flags (a sidecar that does not match the data is an error)
+    metadata = load_channel_metadata(filepath, n_channels)
+
+    npy_path, _, *csv_path = output_paths(recording, csv)
+    tmp_path = npy_path[:-len(".npy")] + f".tmp-{os.getpid()}.npy"
+    array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float64, shape=(n_samples, n_channels))
+    try:
+        start = 0
+        for chunk in iter_chunks(filepath, variable, chunk_samples):
+            with timed("write", recording, samples=len(chunk)):
+                array[start:start + len(chunk)] = chunk
+                # Optional side output: the same array as a CSV file (without index column)
+                if csv:
+                    pd.DataFrame(chunk).to_csv(csv_path[0], index=False, header=start == 0,
+                                               mode="w" if start == 0 else "a")
+            start += len(chunk)
+        array.flush()
+    except BaseException:
+        del array
+        os.remove(tmp_path)
+        raise
+    del array
+    os.replace(tmp_path, npy_path)
+    save_channel_metadata(npy_path, metadata)
+    return variable
+
+
+def main(csv=False, force=False, variable=None, chunk_samples=default_chunk_samples):
+    # Create the output folders if they don't exist
+    os.makedirs(output_folder, exist_ok=True)
+    if csv:
+        os.makedirs(csv_folder, exist_ok=True)
 
-# Define input folder containing .mat files
-input_folder = "../finalproject_records"
+    manifest = {} if force else load_manifest("convert")
+    catalog = load_catalog()
 
-# Define output folder for saving CSV files
-output_folder = "csv_output"
+    # Remove outputs of recordings that are no longer in the catalog
+    for key in sorted(set(manifest) - set(catalog.index)):
+        # Caches written before the catalog existed are keyed by the .mat file name
+        recording = key[:-len(".mat")] if key.endswith(".mat") else key
+        for path in output_paths(recording, csv=True):
+            if os.path.exists(path):
+                os.remove(path)
+        del manifest[key]
+        print(f"🗑️ Removed outputs of deleted recording: {recording}")
 
-# Create the output folder if it doesn't exist
-os.makedirs(output_folder, exist_ok=True)
+    # Only an explicitly chosen variable enters the fingerprint, so existing caches stay valid
+    params = {"csv": csv}
+    if variable is not None:
+        params["variable"] = variable
 
-# Iterate over all files in the input folder
-for filename in os.listdir(input_folder):
-    # Process only .mat files
-    if filename.endswith(".mat"):
-        filepath = os.path.join(input_folder, filename)
+    for recording, row in catalog.iterrows():
+        # The catalog already hashed the .mat file; only the channel sidecar, if any, is hashed here
+        sidecar = channel_metadata_path(source_path(row))
+        fp = fingerprint([sidecar] if os.path.exists(sidecar) else [], {**params, "source": row["Hash"]})
+        if is_fresh(manifest, recording, fp, output_paths(recording, csv)):
+            print(f"⏭️ Up to date: {recording}")
+            continue
 
-        # Load the .mat file
-        mat_data = loadmat(filepath)
+        try:
+            data_variable = convert_recording(recording, row, variable, csv, chunk_samples)
+        except (ValueError, ImportError) as e:
+            print(f"❌ Error in {row['Source']}: {e}")
+            continue
 
-        # Extract the main data key (skip internal __ keys)
-        keys = [k for k in mat_data.keys() if not k.startswith("__")]
-        if keys:
-            data_key = keys[0]  # Assume the first relevant key holds the array
-            array = mat_data[data_key]
+        # A variable named after another condition or role usually means a mislabelled file
+        expected = row["Condition"] + row["Role"]
+        if variable is None and data_variable.lower() != expected:
+            print(f"⚠️ {row['Source']} holds variable {data_variable!r}, expected {expected!r}")
 
-            # Convert the NumPy array to a pandas DataFrame
-            df = pd.DataFrame(array)
+        # Remember the fingerprint and print confirmation message
+        manifest[recording] = fp
+        print(f"✅ Converted: {os.path.basename(row['Source'])} → {recording}.npy")
 
-            # Define the output CSV file path
-            output_filename = filename.replace(".mat", ".csv")
-            output_path = os.path.join(output_folder, output_filename)
+    save_manifest("convert", manifest)
 
-            # Save the DataFrame as a CSV file (without index column)
-            df.to_csv(output_path, index=False)
 
-            # Print confirmation message
-            print(f"✅ Converted: {filename} → {output_filename}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert .mat recordings to .npy (and optionally .csv)")
+    parser.add_argument("--csv", action="store_true", help="also write a CSV copy of every recording")
+    parser.add_argument("--force", action="store_true", help="ignore the build cache and convert every file")
+    parser.add_argument("--variable", default=None,
+                        help="name of the data variable in every .mat file (default: <condition><role>, "
+                             "or the only 2-D numeric variable)")
+    parser.add_argument("--chunk-samples", type=int, default=default_chunk_samples,
+                        help="samples read and written at a time")
+    args = parser.parse_args()
+    with stage("convert"):
+        main(csv=args.csv, force=args.force, variable=args.variable, chunk_samples=args.chunk_samples)
@@ -0,0 +1,276 @@
+"""
+Module Name: correlation_engine.py
+
+Description:
+Batched Pearson correlation engine for intra-brain connectivity.
+
+Instead of calling scipy.stats.pearsonr once per channel pair, a whole stack of
+recordings (N × samples × channels) is centered and correlated with a single
+batched matrix product. Two-sided p-values are computed in closed form from the
+t-distribution with (samples - 2) degrees of freedom, which is exactly the test
+pearsonr performs, and the |r| / p-value thresholding is applied to the whole
+stack in the same vectorized step.
+
+Functions:
+- batch_correlation(stack)                  → r matrices, shape (N, channels, channels)
+- correlation_pvalues(r, n_samples)         → two-sided p-values, same shape as r
+- apply_thresholds(r, p, threshold, p_cutoff)
+- thresholded_correlations(stack, threshold, p_cutoff)
+- CorrelationAccumulator                    → running sums for recordings fed in sample chunks
+- chunked_correlation(recordings, chunk_samples)  → r matrices of memory-mapped recordings, chunk by chunk
+- sliding_window_correlations(stack, width, step)   → generator of (start, r) per window
+- lagged_cross_correlations(x, y, max_lag)          → r of every x/y channel pair at every lag
+
+Sliding windows are not correlated from scratch: the per-channel sums and the channel
+cross-product matrix of the window are kept as running sums and updated by adding the
+samples that enter and subtracting the samples that leave, so moving the window costs
+O(step × channels²) whatever its width.
+
+Long recordings do not need to be in memory at once: CorrelationAccumulator keeps the sample
+count, channel sums and cross-product matrix of the chunks added so far, from which the exact
+correlations of the whole recording follow.
+
+Lagged cross-correlations between two recordings (e.g. baby and parent) come from one batched
+FFT over all channel pairs; the per-lag means and variances of the overlapping samples come from
+prefix sums, so every lag is an exact Pearson correlation of the overlapping segments.
+
+Dependencies:
+- numpy, scipy.special, scipy.fft
+"""
+import numpy as np
+from scipy import fft, special
+
+
+def batch_correlation(stack):
+    """
+    Compute the Pearson correlation matrix of every recording in a stack.
+
+    stack: array of shape (N, samples, channels), or (samples, channels) for a single recording.
+    Returns an array of shape (N, channels, channels) (or (channels, channels) for a single recording).
+    Channels with zero variance get NaN correlations, like pearsonr.
+    """
+    stack = np.asarray(stack, dtype=np.float64)
+    single = stack.ndim == 2
+    if single:
+        stack = stack[np.newaxis]
+
+    # Center every channel, then one batched cross-product gives all covariances
+    centered = stack - stack.mean(axis=1, keepdims=True)
+    cov = np.matmul(centered.transpose(0, 2, 1), centered)
+
+    r = _normalize_covariance(cov, np.diagonal(cov, axis1=1, axis2=2) > 0)
+    return r[0] if single else r
+
+
+def _normalize_covariance(cov, varying):
+    """Turn a stack of (co)variance matrices into correlations; NaN rows for non-varying channels."""
+    # Normalize by the outer product of channel standard deviations
+    std = np.sqrt(np.where(varying, np.diagonal(cov, axis1=1, axis2=2), 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = cov / (std[:, :, np.newaxis] * std[:, np.newaxis, :])
+    r = np.clip(r, -1.0, 1.0)
+
+    # A non-constant channel is perfectly correlated with itself
+    n_channels = r.shape[-1]
+    diag = np.arange(n_channels)
+    r[:, diag, diag] = np.where(varying, 1.0, np.nan)
+    return r
+
+
+def correlation_pvalues(r, n_samples):
+    """
+    Two-sided p-values for Pearson correlations computed from n_samples observations.
+
+    Uses t = r * sqrt(df / (1 - r²)) with df = n_samples - 2, which is the same
+    test scipy.stats.pearsonr performs. |r| = 1 gives p = 0; NaN stays NaN.
+    """
+    r = np.asarray(r, dtype=np.float64)
+    dof = n_samples - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = r * np.sqrt(dof / ((1.0 - r) * (1.0 + r)))
+    return 2.0 * special.stdtr(dof, -np.abs(t))
+
+
+def apply_thresholds(r, p, threshold, p_cutoff):
+    """Keep r only where |r| ≥ threshold and p ≤ p_cutoff; everything else becomes 0."""
+    keep = (p <= p_cutoff) & (np.abs(r) >= threshold)
+    return np.where(keep, r, 0.0)
+
+
+def thresholded_correlations(stack, threshold, p_cutoff):
+    """
+    Correlate, test and threshold a whole stack of recordings in one pass.
+
+    Returns the thresholded correlation matrices, shape (N, channels, channels).
+    """
+    stack = np.asarray(stack, dtype=np.float64)
+    r = batch_correlation(stack)
+    p = correlation_pvalues(r, stack.shape[-2])
+    return apply_thresholds(r, p, threshold, p_cutoff)
+
+
+class CorrelationAccumulator:
+    """
+    Pearson correlations of a stack of recordings fed in consecutive chunks of samples.
+
+    Only the sufficient statistics are kept: the sample count, the per-channel sums and the
+    channel cross-product matrix (whose diagonal holds the sums of squares). Their size does not
+    depend on the recording length, so memory stays flat however many chunks are added. Samples
+    are shifted by the mean of the first chunk before they are summed, which does not change any
+    correlation but keeps the sums small, so the covariances do not lose precision.
+    """
+
+    def __init__(self):
+        self.n_samples = 0
+        self.shift = self.sums = self.products = None
+        self.single = None
+
+    def update(self, chunk):
+        """Add a chunk of shape (N, samples, channels), or (samples, channels) for a single recording."""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if self.single is None:
+            self.single = chunk.ndim == 2
+        if self.single:
+            chunk = chunk[np.newaxis]
+        if chunk.shape[1] == 0:
+            return
+        if self.shift is None:
+            self.shift = chunk.mean(axis=1, keepdims=True)
+            self.sums = np.zeros((chunk.shape[0], chunk.shape[2]))
+            self.products = np.zeros((chunk.shape[0], chunk.shape[2], chunk.shape[2]))
+        x = chunk - self.shift
+        self.sums += x.sum(axis=1)
+        self.products += np.matmul(x.transpose(0, 2, 1), x)
+        self.n_samples += chunk.shape[1]
+
+    def correlation(self):
+        """Correlation matrices of everything added so far; channels that never varied get NaN."""
+        if self.n_samples == 0:
+            raise ValueError("no samples were added")
+        cov = self.products - self.sums[:, :, np.newaxis] * self.sums[:, np.newaxis, :] / self.n_samples
+        squares = np.diagonal(self.products, axis1=1, axis2=2)
+        varying = np.diagonal(cov, axis1=1, axis2=2) > 1e-12 * squares
+        r = _normalize_covariance(cov, varying)
+        return r[0] if self.single else r
+
+
+def chunked_correlation(recordings, chunk_samples):
+    """
+    Correlation matrices of equally shaped recordings (samples × channels each), read chunk_samples
+    samples at a time, e.g. from memory-mapped files. Returns an array (N, channels, channels).
+    """
+    accumulator = CorrelationAccumulator()
+    n_samples = recordings[0].shape[0]
+    for start in range(0, n_samples, chunk_samples):
+        accumulator.update(np.stack([data[start:start + chunk_samples] for data in recordings]))
+    return accumulator.correlation()
+
+
+def sliding_window_correlations(stack, width, step):
+    """
+    Yield (start, r) for every window of `width` samples, moving by `step` samples.
+
+    stack: (N, samples, channels) or (samples, channels); r has shape (N, channels, channels)
+    (or (channels, channels)). Windows that would run past the end are not produced.
+    The window sums are updated incrementally; channels that are constant within a window
+    get NaN correlations, like batch_correlation.
+    """
+    stack = np.asarray(stack, dtype=np.float64)
+    single = stack.ndim == 2
+    if single:
+        stack = stack[np.newaxis]
+    n_samples = stack.shape[1]
+    if width < 3 or width > n_samples:
+        raise ValueError(f"window width must be between 3 and {n_samples} samples, got {width}")
+    if step < 1:
+        raise ValueError(f"window step must be at least 1 sample, got {step}")
+
+    # Centering on the recording mean does not change any correlation but keeps the running
+    # sums small, so adding and subtracting samples does not lose precision
+    x = stack - stack.mean(axis=1, keepdims=True)
+
+    def window_sums(start):
+        window = x[:, start:start + width]
+        return window.sum(axis=1), np.matmul(window.transpose(0, 2, 1), window)
+
+    start = 0
+    sums, products = window_sums(start)
+    while True:
+        cov = products - sums[:, :, np.newaxis] * sums[:, np.newaxis, :] / width
+        squares = np.diagonal(products, axis1=1, axis2=2)
+        varying = np.diagonal(cov, axis1=1, axis2=2) > 1e-12 * squares
+        r = _normalize_covariance(cov, varying)
+        yield start, (r[0] if single else r)
+
+        next_start = start + step
+        if next_start + width > n_samples:
+            break
+        if step >= width:
+            # Windows do not overlap: nothing to carry over
+            sums, products = window_sums(next_start)
+        else:
+            leaving = x[:, start:next_start]
+            entering = x[:, start + width:next_start + width]
+            sums += entering.sum(axis=1) - leaving.sum(axis=1)
+            products += (np.matmul(entering.transpose(0, 2, 1), entering)
+                         - np.matmul(leaving.transpose(0, 2, 1), leaving))
+        start = next_start
+
+
+def lagged_cross_correlations(x, y, max_lag):
+    """
+    Pearson correlation of every channel of x with every channel of y at lags -max_lag..max_lag.
+
+    x: (N, samples, channels_x), y: (N, samples, channels_y), or 2-D for a single pair.
+    Returns (lags, r) with r of shape (N, 2 * max_lag + 1, channels_x, channels_y), where
+    r[:, k, i, j] = corr(x_i[t], y_j[t + lags[k]]) over the samples where both exist,
+    i.e. a positive lag means y follows x. Constant segments give NaN.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    single = x.ndim == 2
+    if single:
+        x, y = x[np.newaxis], y[np.newaxis]
+    n_samples = x.shape[1]
+    if y.shape[1] != n_samples:
+        raise ValueError(f"recordings differ in length: {n_samples} and {y.shape[1]} samples")
+    if not 0 <= max_lag <= n_samples - 3:
+        raise ValueError(f"max_lag must be between 0 and {n_samples - 3} samples, got {max_lag}")
+
+    # Centering on the recording mean keeps the sums below well conditioned
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+    lags = np.arange(-max_lag, max_lag + 1)
+
+    # Cross-products at every lag for all channel pairs: one FFT per channel, one product per pair.
+    # Zero-padding to at least samples + max_lag avoids circular wrap-around for the lags we keep.
+    n_fft = fft.next_fast_len(n_samples + max_lag)
+    x_spectrum = fft.rfft(x, n_fft, axis=1)
+    y_spectrum = fft.rfft(y, n_fft, axis=1)
+    cross = fft.irfft(np.conj(x_spectrum)[:, :, :, np.newaxis] * y_spectrum[:, :, np.newaxis, :], n_fft, axis=1)
+    sum_xy = cross[:, lags % n_fft]
+
+    # Sums over the overlapping samples of each lag, from prefix sums
+    def overlap_sums(values, starts, stops):
+        prefix = np.concatenate([np.zeros_like(values[:, :1]), np.cumsum(values, axis=1)], axis=1)
+        return prefix[:, stops] - prefix[:, starts]
+
+    overlap = n_samples - np.abs(lags)
+    x_starts, x_stops = np.maximum(0, -lags), n_samples - np.maximum(0, lags)
+    y_starts, y_stops = np.maximum(0, lags), n_samples - np.maximum(0, -lags)
+    sum_x, sum_xx = overlap_sums(x, x_starts, x_stops), overlap_sums(x * x, x_starts, x_stops)
+    sum_y, sum_yy = overlap_sums(y, y_starts, y_stops), overlap_sums(y * y, y_starts, y_stops)
+
+    m = overlap[np.newaxis, :, np.newaxis]
+    cov = sum_xy - sum_x[..., :, np.newaxis] * sum_y[..., np.newaxis, :] / m[..., np.newaxis]
+    var_x = sum_xx - sum_x ** 2 / m
+    var_y = sum_yy - sum_y ** 2 / m
+    varying_x = var_x > 1e-12 * sum_xx
+    varying_y = var_y > 1e-12 * sum_yy
+    std_x = np.sqrt(np.where(varying_x, var_x, np.nan))
+    std_y = np.sqrt(np.where(varying_y, var_y, np.nan))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = cov / (std_x[..., :, np.newaxis] * std_y[..., np.newaxis, :])
+    r = np.clip(r, -1.0, 1.0)
+
+    return lags, (r[0] if single else r)
@@ -0,0 +1,239 @@
+"""
+Module Name: correlation_store.py
+
+Description:
+Compact binary store of the thresholded intra-brain correlation matrices, written by the
+connectivity stage (intra_brain_connectivity.py) and read by the graph stages
+(extract_intra_measures.py, render_graphs.py) instead of one text CSV per recording.
+
+A correlation matrix is symmetric, so only its strict upper triangle is stored, as float32. The
+n(n-1)/2 values of every recording with n nodes are the rows of a single array, saved as one .npy
+file that is memory-mapped (or loaded in one read) by the readers. The diagonal is kept in a small
+array of its own: it is 1, or 0 for a constant channel, and the metrics count it. Montages of
+different sizes get one pair of arrays per node count. Every write is a new generation folder,
+and the one-line CURRENT file names the generation readers use:
+
+    correlation_store/CURRENT                           name of the current generation
+    correlation_store/<generation>/index.csv            Recording, Nodes, Row, Hash, Channels
+    correlation_store/<generation>/triangles_<n>.npy    float32, (recordings with n nodes) × n(n-1)/2
+    correlation_store/<generation>/diagonals_<n>.npy    float32, (recordings with n nodes) × n
+
+- Recording: canonical recording id (recording_catalog.py), e.g. "dyad11_instruct_parent";
+- Nodes / Row: node count of the matrix and its row in the arrays of that node count;
+- Hash: SHA-256 of the recording's triangle, diagonal and channel names; the build caches of the
+  reading stages fingerprint it instead of a file;
+- Channels: the channel names (node labels), separated by ";".
+
+float32 keeps about 7 significant digits, against the 3 decimals the metrics are reported with.
+Rounding to float32 is monotone and the stored matrices are already thresholded at |r| ≥ 0.3, so
+binarizing them at 0.3 gives exactly the graphs of the float64 matrices.
+
+A new generation is written completely before CURRENT is replaced (os.replace, atomic), so a
+reader always finds either the previous store or the new one, never half a store or none. The
+previous generation is kept for readers that read CURRENT just before the swap; older ones are
+removed. Each process caches the index and the memory-mapped arrays of a generation, and reloads
+them when CURRENT names another one.
+
+Functions:
+- pack(matrix)                        → (triangle, diagonal) float32 of one square matrix
+- expand(triangles, diagonals)        → float64 square matrix (or stack of matrices)
+- matrix_hash(triangle, diagonal, names)
+- write_store(entries)                → write {recording: (triangle, diagonal, names)} as the store
+- current_folder()                    → folder of the current generation, or None if there is no store
+- load_index()                        → DataFrame indexed by Recording (empty if there is no store)
+- load_entries(recordings)            → {recording: (triangle, diagonal, names)} of stored recordings
+- load_matrix(recording)              → (square matrix, channel names)
+- load_matrices(recordings)           → {nodes: (recordings, stack of square matrices)}
+- channel_names(recording)            → channel names of a stored recording
+
+Dependencies:
+- numpy, pandas, hashlib, os, shutil, time
+"""
+import os
+import time
+import shutil
+import hashlib
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# === Folder Paths (relative to this script) ===
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_FOLDER = os.path.join(SCRIPT_DIR, "correlation_store")
+POINTER_FILE = os.path.join(STORE_FOLDER, "CURRENT")
+
+INDEX_COLUMNS = ["Recording", "Nodes", "Row", "Hash", "Channels"]
+CHANNEL_SEPARATOR = ";"
+
+# Store of this process, reloaded when CURRENT names another generation: generation → {"index", "arrays"}
+_loaded = {}
+
+
+@lru_cache(maxsize=None)
+def triangle_indices(n):
+    """Row and column indices of the strict upper triangle of an n × n matrix (row-major order)."""
+    return np.triu_indices(n, k=1)
+
+
+def pack(matrix):
+    """Strict upper triangle and diagonal of a square matrix, as float32."""
+    matrix = np.asarray(matrix)
+    rows, columns = triangle_indices(matrix.shape[0])
+    return matrix[rows, columns].astype(np.float32), np.diagonal(matrix).astype(np.float32)
+
+
+def expand(triangles, diagonals):
+    """
+    Square float64 matrices from stored triangles and diagonals.
+
+    One triangle (n(n-1)/2,) and diagonal (n,) give one n × n matrix; stacks (N × ...) give N × n × n.
+    """
+    triangles, diagonals = np.asarray(triangles), np.asarray(diagonals)
+    n = diagonals.shape[-1]
+    rows, columns = triangle_indices(n)
+    matrices = np.zeros(diagonals.shape[:-1] + (n, n))
+    matrices[..., rows, columns] = triangles
+    matrices[..., columns, rows] = triangles
+    matrices[..., np.arange(n), np.arange(n)] = diagonals
+    return matrices
+
+
+def matrix_hash(triangle, diagonal, names):
+    """SHA-256 of one stored matrix: its triangle, diagonal and channel names."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(triangle, dtype=np.float32).tobytes())
+    digest.update(np.ascontiguousarray(diagonal, dtype=np.float32).tobytes())
+    digest.update(CHANNEL_SEPARATOR.join(names).encode())
+    return digest.hexdigest()
+
+
+def array_paths(folder, n):
+    return (os.path.join(folder, f"triangles_{n}.npy"), os.path.join(folder, f"diagonals_{n}.npy"))
+
+
+def write_store(entries):
+    """
+    Write entries = {recording: (triangle, diagonal, channel names)} as the whole store.
+
+    Recordings are sorted by id, and grouped by node count into one pair of arrays each.
+    """
+    rows, groups = [], {}
+    for recording in sorted(entries):
+        triangle, diagonal, names = entries[recording]
+        group = groups.setdefault(len(diagonal), ([], []))
+        rows.append({
+            "Recording": recording,
+            "Nodes": len(diagonal),
+            "Row": len(group[0]),
+            "Hash": matrix_hash(triangle, diagonal, names),
+            "Channels": CHANNEL_SEPARATOR.join(names),
+        })
+        group[0].append(np.asarray(triangle, dtype=np.float32))
+        group[1].append(np.asarray(diagonal, dtype=np.float32))
+
+    generation = f"{time.time_ns()}-{os.getpid()}"
+    folder = os.path.join(STORE_FOLDER, generation)
+    os.makedirs(folder)
+    for n, (triangles, diagonals) in groups.items():
+        triangle_path, diagonal_path = array_paths(folder, n)
+        np.save(triangle_path, np.stack(triangles).reshape(len(triangles), n * (n - 1) // 2))
+        np.save(diagonal_path, np.stack(diagonals))
+    pd.DataFrame(rows, columns=INDEX_COLUMNS).to_csv(os.path.join(folder, "index.csv"), index=False)
+
+    # Point readers at the new generation in one atomic step
+    previous = current_generation()
+    tmp_pointer = f"{POINTER_FILE}.tmp-{os.getpid()}"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp_pointer, POINTER_FILE)
+
+    # Keep the previous generation for readers that were opening it; remove everything else
+    for name in os.listdir(STORE_FOLDER):
+        path = os.path.join(STORE_FOLDER, name)
+        if name in (generation, previous, "CURRENT") or ".tmp-" in name:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def current_generation():
+    """Name of the generation CURRENT points at, or None if there is no store."""
+    try:
+        with open(POINTER_FILE, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_folder():
+    """Folder of the current store generation, or None if there is no store."""
+    generation = current_generation()
+    return None if generation is None else os.path.join(STORE_FOLDER, generation)
+
+
+def _store():
+    """Index and memory-mapped arrays of the current store ({} arrays if there is no store)."""
+    generation = current_generation()
+    if generation is None:
+        return {"index": pd.DataFrame(columns=INDEX_COLUMNS[1:], index=pd.Index([], name="Recording")),
+                "arrays": {}}
+    if generation not in _loaded:
+        folder = os.path.join(STORE_FOLDER, generation)
+        index = pd.read_csv(os.path.join(folder, "index.csv"), index_col="Recording",
+                            dtype={"Hash": str, "Channels": str}, keep_default_na=False)
+        arrays = {}
+        for n in index["Nodes"].unique():
+            triangle_path, diagonal_path = array_paths(folder, n)
+            arrays[int(n)] = (np.load(triangle_path, mmap_mode="r"), np.load(diagonal_path, mmap_mode="r"))
+        _loaded.clear()
+        _loaded[generation] = {"index": index, "arrays": arrays}
+    return _loaded[generation]
+
+
+def load_index():
+    """Index of the store (Nodes, Row, Hash, Channels), indexed by Recording; empty if there is no store."""
+    return _store()["index"]
+
+
+def channel_names(recording):
+    """Channel names (node labels) of a stored recording."""
+    return load_index().loc[recording, "Channels"].split(CHANNEL_SEPARATOR)
+
+
+def load_entries(recordings):
+    """{recording: (triangle, diagonal, channel names)} of the given recordings found in the store."""
+    store = _store()
+    index = store["index"]
+    entries = {}
+    for recording in recordings:
+        if recording not in index.index:
+            continue
+        row = index.loc[recording]
+        triangles, diagonals = store["arrays"][int(row["Nodes"])]
+        entries[recording] = (np.array(triangles[row["Row"]]), np.array(diagonals[row["Row"]]),
+                              row["Channels"].split(CHANNEL_SEPARATOR))
+    return entries
+
+
+def load_matrix(recording):
+    """Square correlation matrix (float64) and channel names of one stored recording."""
+    triangle, diagonal, names = load_entries([recording])[recording]
+    return expand(triangle, diagonal), names
+
+
+def load_matrices(recordings):
+    """
+    Square matrices of stored recordings, stacked per node count: {nodes: (recordings, N × n × n)}.
+
+    Each stack is gathered from the memory-mapped arrays in one indexed read.
+    """
+    store = _store()
+    index = store["index"].loc[list(recordings)]
+    groups = {}
+    for n, group in index.groupby("Nodes", sort=True):
+        triangles, diagonals = store["arrays"][int(n)]
+        rows = group["Row"].to_numpy()
+        groups[int(n)] = (group.index.tolist(), expand(triangles[rows], diagonals[rows]))
+    return groups